@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# A store is a pair of files: `<path>.bin` holds the upper triangle (diagonal
+# included) of a symmetric gene x gene matrix, row by row, and `<path>.json`
+# holds the gene order, dtype and module membership.
+
+def triangle_size(n:int) -> int:
+    return n * (n + 1) // 2
+
+def write_store(matrix:pd.DataFrame, path:str, modules:dict=None, dtype:str='float32') -> None:
+    genes = matrix.index.tolist()
+    if genes != matrix.columns.tolist():
+        raise ValueError("Adjacency matrix rows and columns must list the same genes in the same order.")
+
+    values = matrix.values
+    tmp = f"{path}.bin.tmp"
+    with open(tmp, 'wb') as f:
+        # One row at a time, so the packed copy never has to fit in memory.
+        for i in range(len(genes)):
+            f.write(np.ascontiguousarray(values[i, i:], dtype=dtype).tobytes())
+    os.replace(tmp, f"{path}.bin")
+
+    with open(f"{path}.json", 'w') as f:
+        json.dump({'genes': genes, 'dtype': dtype, 'modules': modules or {}}, f)
+
+def build_from_wgcna(wgcna, modules:list, path:str, tom:bool=False, dtype:str='float32') -> None:
+    # getGeneModule returns the module's rows of the gene info table, indexed by gene.
+    membership = {module: wgcna.getGeneModule(module)[module].index.tolist() for module in modules}
+    if tom:
+        matrix = wgcna.TOM
+    else:
+        genes = [gene for module in modules for gene in membership[module]]
+        matrix = wgcna.adjacency.loc[genes, genes]
+    write_store(matrix, path, membership, dtype)
+
+class AdjacencyStore:
+    def __init__(self, path:str):
+        with open(f"{path}.json") as f:
+            meta = json.load(f)
+        self.genes = meta['genes']
+        self.modules = meta['modules']
+        self.index = {gene: i for i, gene in enumerate(self.genes)}
+        self.n = len(self.genes)
+        self.values = np.memmap(f"{path}.bin", dtype=meta['dtype'], mode='r', shape=(triangle_size(self.n),))
+
+    def __contains__(self, gene:str) -> bool:
+        return gene in self.index
+
+    def positions(self, genes:list) -> np.ndarray:
+        missing = [gene for gene in genes if gene not in self.index]
+        if missing:
+            raise KeyError(f"Genes not in adjacency store: {', '.join(missing)}")
+        return np.array([self.index[gene] for gene in genes], dtype=np.int64)
+
+    def submatrix(self, rows:list, cols:list=None) -> pd.DataFrame:
+        cols = rows if cols is None else cols
+        i = self.positions(rows)[:, None]
+        j = self.positions(cols)[None, :]
+        lo, hi = np.minimum(i, j), np.maximum(i, j)
+        offsets = lo * self.n - lo * (lo - 1) // 2 + (hi - lo)
+
+        # Only the pages holding the requested entries are read from disk.
+        values = np.asarray(self.values[offsets.ravel()], dtype=np.float32).reshape(offsets.shape)
+        return pd.DataFrame(values, index=rows, columns=cols)
+
+    def module(self, name:str) -> pd.DataFrame:
+        return self.submatrix(self.modules[name])
+
+    def module_pair(self, a:str, b:str) -> pd.DataFrame:
+        return self.submatrix(self.modules[a], self.modules[b])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build a binary adjacency store from a module csv or a saved PyWGCNA object.")
+    parser.add_argument('path', help="Store path, without extension.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--csv', help="Module adjacency csv, as written by PyWGCNA (genes as index and header).")
+    source.add_argument('--from-wgcna', help="PyWGCNA object saved with saveWGCNA (e.g. data/wgcna/TUNA_kd.p).")
+    parser.add_argument('--modules', nargs='+', required=True, help="Module name(s) the genes belong to; one name with --csv.")
+    parser.add_argument('--tom', action='store_true', help="With --from-wgcna, store the whole-genome TOM instead of the module adjacencies.")
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    parser.add_argument('--current', action='store_true', help="With --from-wgcna, the object was built from all ingested samples; clears the stale adjacency flag.")
+    args = parser.parse_args()
+
+    if args.from_wgcna:
+        import PyWGCNA
+
+        build_from_wgcna(PyWGCNA.readWGCNA(args.from_wgcna), args.modules, args.path, args.tom, args.dtype)
+        if args.current:
+            import ingest
+
+            ingest.mark_fresh('adjacency')
+    else:
+        if len(args.modules) != 1:
+            parser.error("--csv takes exactly one module name.")
+        matrix = pd.read_csv(args.csv, index_col=0)
+        write_store(matrix, args.path, {args.modules[0]: matrix.index.tolist()}, args.dtype)
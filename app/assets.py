@@ -0,0 +1,48 @@
+import hashlib
+import os
+import streamlit as st
+
+CACHE_DIR = 'data/wgcna/figures/cache'
+
+@st.cache_data(show_spinner=False)
+def file_hash(path:str, mtime_ns:int, size:int) -> str:
+    # The stat values are only part of the cache key: the PDF is hashed again
+    # when it changes on disk, and a plain rerun reads none of its bytes.
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@st.cache_data(show_spinner=False)
+def rasterise_pdf(path:str, digest:str, width:int, fmt:str='png', quality:int=85) -> str:
+    # The digest is part of the cache key (in memory and on disk), so editing a
+    # figure invalidates its images without touching the cache by hand.
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    out = os.path.join(CACHE_DIR, f"{stem}-{digest[:16]}-{width}.{fmt}")
+    if os.path.exists(out):
+        return out
+
+    import pymupdf
+
+    with pymupdf.open(path) as doc:
+        page = doc[0]
+        zoom = width / page.rect.width
+        pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+        tmp = f"{out}.tmp.{os.getpid()}"
+        if fmt == 'jpg':
+            pixmap.save(tmp, output='jpg', jpg_quality=quality)
+        else:
+            pixmap.save(tmp, output='png')
+        os.replace(tmp, out)
+    return out
+
+def figure(path:str, width:int, fmt:str='png', zoom:bool=True) -> None:
+    stat = os.stat(path)
+    digest = file_hash(path, stat.st_mtime_ns, stat.st_size)
+    st.image(rasterise_pdf(path, digest, width, fmt), width=width)
+
+    # The full-resolution variant is only rendered and sent once requested.
+    if zoom and st.toggle("Show full resolution", key=f"zoom_{path}"):
+        st.image(rasterise_pdf(path, digest, width * 2, fmt))
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+def standardise(values:np.ndarray) -> np.ndarray:
+    # Rows are centred and scaled to unit norm, so the dot product of two rows
+    # is their Pearson correlation.
+    centred = values - values.mean(axis=1, keepdims=True)
+    return (centred / np.linalg.norm(centred, axis=1, keepdims=True)).astype(np.float32)
+
+class CoexpressionIndex:
+    def __init__(self, tpm:pd.DataFrame):
+        # Genes with a flat profile have no defined correlation and are left out.
+        tpm = tpm[tpm.std(axis=1) > 0]
+        self.n_samples = tpm.shape[1]
+        self.genes = tpm.index.tolist()
+        self.index = {gene: i for i, gene in enumerate(self.genes)}
+        self.profiles = {
+            'pearson': standardise(tpm.values.astype(np.float64)),
+            'spearman': standardise(tpm.rank(axis=1).values),
+        }
+
+    def __contains__(self, gene:str) -> bool:
+        return gene in self.index
+
+    def neighbours(self, gene:str, k:int=10, method:str='pearson', block_size:int=8192) -> pd.DataFrame:
+        profiles = self.profiles[method]
+        query = profiles[self.index[gene]]
+
+        # Blocked matrix-vector products keep the temporaries small; each block
+        # contributes its own top k candidates.
+        candidates = []
+        for start in range(0, len(profiles), block_size):
+            scores = profiles[start:start + block_size] @ query
+            top = np.argpartition(scores, -min(k + 1, len(scores)))[-(k + 1):]
+            candidates += [(start + i, scores[i]) for i in top]
+
+        candidates = sorted(
+            ((i, score) for i, score in candidates if i != self.index[gene]),
+            key=lambda candidate: candidate[1], reverse=True
+        )[:k]
+        return pd.DataFrame({
+            'gene': [self.genes[i] for i, _ in candidates],
+            'correlation': [float(score) for _, score in candidates],
+        })
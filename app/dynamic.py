@@ -2,9 +2,10 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import random
+import ingest
 import lib
-import matplotlib.pyplot as plt
-import plotly.graph_objects as go
+import plots
+import results
 
 
 def dynamic_page():
@@ -134,17 +135,71 @@ def dynamic_page():
     metadata = st.session_state.metadata
     hyp = st.session_state.hyp
 
-    median_tpm = lib.calculate_median_tpm(tpm, metadata)
+    median_tpm = lib.load_median_tpm(tpm, metadata)
+    gene_index = lib.load_gene_index()
     module_genes = adjmat.index.tolist()
     genes = hyp.index.tolist()[0:10]
 
     observed_time_points = np.arange(median_tpm.shape[1])
 
+    if 'model_genes' not in st.session_state:
+        st.session_state.model_genes = genes
+    if 'extra_genes' not in st.session_state:
+        st.session_state.extra_genes = []
+
+    coexpression_index = lib.load_coexpression_index(ingest.data_version())
+    st.write(
+        f"""
+        Genes that are co-expressed with a gene of interest can be found by querying the TPM profiles across all \
+        {coexpression_index.n_samples} samples directly, and added to the model. Genes outside the `maroon` module \
+        are modelled without network interactions.
+        """
+    )
+
+    query = st.text_input('Find genes co-expressed with', placeholder='e.g. Wls')
+    matches = [gene for gene in gene_index.search(query, limit=50) if gene in coexpression_index]
+    if query and not matches:
+        st.warning(f"No genes with a varying TPM profile match '{query}'.")
+    elif matches:
+        col1, col2, col3 = st.columns(3)
+        query_gene = col1.selectbox('Gene', matches, format_func=gene_index.label)
+        k = col2.number_input('Number of neighbours', min_value=1, max_value=100, value=10)
+        method = col3.selectbox('Correlation', ['pearson', 'spearman'])
+
+        neighbours = coexpression_index.neighbours(query_gene, k, method)
+        neighbours['module'] = neighbours['gene'].map(gene_index.module)
+        st.dataframe(neighbours, use_container_width=True)
+
+        if st.button('Add neighbours to the model selection'):
+            new_genes = [gene for gene in neighbours['gene'] if gene in median_tpm.index]
+            st.session_state.extra_genes = list(dict.fromkeys(st.session_state.extra_genes + new_genes))
+            st.session_state.model_genes = list(dict.fromkeys(st.session_state.model_genes + new_genes))
+
+    # Genes added from the co-expression query have no adjacency to the module,
+    # so their interaction weights are zero.
+    module_genes = list(dict.fromkeys(module_genes + st.session_state.extra_genes))
+    adjmat = adjmat.reindex(index=module_genes, columns=module_genes, fill_value=0)
+
     with st.form('Model feature definition'):
-        options = st.multiselect('Select genes to model', module_genes, genes)
+        options = st.multiselect('Select genes to model', module_genes, key='model_genes', format_func=gene_index.label)
         decay_rate = st.slider('Decay rate', 0.0, 1.0, 0.5)
         carrying_capacity = st.slider('Carrying capacity (maximum gene expression value)', 0.1, 100.0, 10.0)
         num_days = st.number_input('Number of days to predict', min_value=1, max_value=30, value=7)
+        block_fit = st.checkbox('Block-decomposed fitting (fits weakly coupled groups of genes separately, for large selections)')
+        block_threshold = st.slider('Block edge-weight threshold', 0.0, 1.0, 0.3)
+        refine = st.checkbox(
+            'Jointly refine the block estimates',
+            help=f'Runs 20 optimiser iterations on the full model after the block fit. Slow, and only available for up to {lib.REFINE_MAX_GENES} genes.'
+        )
+        uncertainty = st.checkbox(
+            'Estimate uncertainty (bootstrap over biological replicates)',
+            help='Every resample is refitted (at most 50 optimiser iterations each), so this can take several minutes.'
+        )
+        n_boot = st.number_input('Bootstrap resamples', min_value=5, max_value=200, value=20)
+        gene_set_name = st.text_input(
+            'Gene set name (optional)',
+            help='The fit is saved under this name. Without one, it is saved under a key derived from the selected genes.'
+        )
 
         submitted = st.form_submit_button('Run model')
 
@@ -153,43 +208,138 @@ def dynamic_page():
             init_conditions = median_tpm.loc[module_genes].iloc[:, 0].values
             init_params = np.concatenate([np.ones(len(module_genes)) * decay_rate, np.ones(len(module_genes)) * carrying_capacity])
             time_points = np.linspace(0, num_days, num_days + 1)
+            adj_matrix = adjmat.loc[module_genes, module_genes].values
 
-            result = lib.optimize_params(
-                lib.objective_function,
-                init_params,
-                adjmat.values,
-                init_conditions,
-                observed_time_points,
-                median_tpm.loc[module_genes]
-            )
+            if block_fit and refine and len(module_genes) > lib.REFINE_MAX_GENES:
+                st.warning(f"Joint refinement is only available for up to {lib.REFINE_MAX_GENES} genes, so the blocks are not refined.")
+                refine = False
 
+            if block_fit:
+                result = lib.fit_gene_set_blocks(
+                    module_genes,
+                    median_tpm,
+                    adjmat,
+                    decay_rate,
+                    carrying_capacity,
+                    block_threshold,
+                    max_block_size=20,
+                    refine_iter=20 if refine else 0
+                )
+            else:
+                result = lib.optimize_params(
+                    lib.objective_function,
+                    init_params,
+                    adj_matrix,
+                    init_conditions,
+                    observed_time_points,
+                    median_tpm.loc[module_genes]
+                )
+
+            # A block fit without refinement belongs to the block-diagonal adjacency.
+            adj_matrix = result.get('adj_matrix', adj_matrix)
+            if result.get('message') and not result.success:
+                st.warning(result.message)
             model_predictions = lib.integrate_model(
                 lib.gene_network_dynamics,
                 init_conditions,
                 time_points,
-                adjmat.values,
+                adj_matrix,
                 result.x
             )
 
-            st.write("***")
+            intervals, lower, upper = None, None, None
+            if uncertainty:
+                with st.spinner(f"Refitting {n_boot} bootstrap resamples..."):
+                    samples, bootstrap_conditions = lib.bootstrap_fit(
+                        module_genes, tpm, metadata, adjmat, result.x, n_boot,
+                        block_threshold=block_threshold if block_fit else None,
+                        decay_rate=decay_rate,
+                        carrying_capacity=carrying_capacity,
+                        refine_iter=20 if block_fit and refine else 0
+                    )
+                    bootstrap_predictions = np.array([
+                        lib.integrate_model(lib.gene_network_dynamics, conditions, time_points, adj_matrix, params)
+                        for params, conditions in zip(samples, bootstrap_conditions)
+                    ])
+                    lower, upper = np.percentile(bootstrap_predictions, [2.5, 97.5], axis=0)
+                    intervals = lib.bootstrap_intervals(samples, module_genes).assign(
+                        r=result.x[:len(module_genes)],
+                        K=result.x[len(module_genes):]
+                    )[['r', 'r_low', 'r_high', 'K', 'K_low', 'K_high']]
 
-            st.write(f"Optimised decay rates: {result.x}")
+            run_id = results.write_fit(
+                gene_set_name or results.gene_set_key(module_genes),
+                module_genes,
+                result.x,
+                time_points,
+                model_predictions,
+                loss=float(result.fun),
+                decay_rate=decay_rate,
+                carrying_capacity=carrying_capacity,
+                block_fit=block_fit
+            )
 
-            fig = go.Figure()
+            # Kept in session state so the plot can be re-drawn (other view, other
+            # gene) without refitting the model.
+            st.session_state.model_fit = {
+                'genes': module_genes,
+                'params': result.x,
+                'loss': float(result.fun),
+                'blocks': result.get('blocks'),
+                'refined': result.get('refined', False),
+                'time_points': time_points,
+                'predictions': model_predictions,
+                'observed_time_points': observed_time_points,
+                'observed': median_tpm.loc[module_genes].values.T,
+                'intervals': intervals,
+                'lower': lower,
+                'upper': upper,
+                'run_id': run_id,
+            }
 
-            # Add traces for observed and modeled data
-            for i, gene in enumerate(module_genes):
-                fig.add_trace(go.Scatter(x=time_points, y=median_tpm.loc[gene, :], mode='lines+markers', name=f'Observed {gene}', line=dict(dash='dash')))
-                fig.add_trace(go.Scatter(x=time_points, y=model_predictions[:, i], mode='lines', name=f'Modelled {gene}'))
+    if 'model_fit' in st.session_state:
+        model_fit = st.session_state.model_fit
+        module_genes = model_fit['genes']
 
-            # Update layout
-            fig.update_layout(
-                title=f'Model Fit for Module: Maroon',
-                xaxis_title='Time',
-                yaxis_title='Gene Expression (TPM)',
-                legend_title='Legend',
-                height=900
-            )
+        st.write("***")
+
+        if model_fit['blocks']:
+            st.write(f"Fitted {len(model_fit['blocks'])} blocks of sizes {sorted(map(len, model_fit['blocks']), reverse=True)}")
+            if not model_fit['refined']:
+                st.caption("Interactions between blocks are not part of the model, so predictions are integrated block by block.")
+        st.write(f"Squared error loss: {model_fit['loss']:.4g}")
+        st.write(f"Optimised decay rates: {model_fit['params']}")
+
+        if model_fit['intervals'] is not None:
+            st.write("95% bootstrap confidence intervals for the growth rates (r) and carrying capacities (K):")
+            st.dataframe(model_fit['intervals'])
+
+        views = ['Per gene', 'All genes (WebGL)', 'Module summary']
+        view = st.radio('Plot', views, index=0 if len(module_genes) <= 20 else 1, horizontal=True)
+
+        if view == 'Per gene':
+            fig = plots.per_gene_figure(model_fit)
+        elif view == 'All genes (WebGL)':
+            max_points = st.slider('Maximum points per gene', 10, 1000, 200)
+            fig = plots.packed_figure(model_fit, max_points)
+        else:
+            gene = st.selectbox('Drill down to gene', [None] + module_genes)
+            fig = plots.summary_figure(model_fit, gene)
+
+        fig.update_layout(
+            title=f'Model Fit for Module: Maroon',
+            xaxis_title='Time',
+            yaxis_title='Gene Expression (TPM)',
+            legend_title='Legend',
+            height=900
+        )
+
+        # Display the plot in Streamlit
+        st.plotly_chart(fig)
+        st.caption(f"Fit saved as run `{model_fit['run_id']}` in `{results.DEFAULT_PATH}`.")
 
-            # Display the plot in Streamlit
-            st.plotly_chart(fig)
+    with st.expander("Saved fits"):
+        try:
+            st.dataframe(results.list_runs('fits'), use_container_width=True)
+        except (OSError, KeyError) as e:
+            st.warning(f"Could not read the saved fits: {e}")
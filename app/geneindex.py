@@ -0,0 +1,77 @@
+from bisect import bisect_left
+from collections import defaultdict
+import pandas as pd
+
+class GeneIndex:
+    def __init__(self, mart:pd.DataFrame, modules:dict):
+        self.id_to_symbol = {}
+        self.symbol_to_ids = defaultdict(list)
+        for gene_id, symbol in zip(mart['Gene_stable_ID'], mart['Gene_name']):
+            # Genes without a symbol are known by their Ensembl ID, as in deseq.R.
+            symbol = symbol if isinstance(symbol, str) and symbol else gene_id
+            self.id_to_symbol[gene_id] = symbol
+            self.symbol_to_ids[symbol].append(gene_id)
+
+        self.gene_to_module = {}
+        for module, genes in modules.items():
+            for gene in genes:
+                self.gene_to_module[gene] = module
+
+        # Search keys are lower-cased symbols and IDs. A sorted list answers prefix
+        # queries by bisection; a trigram index answers substring queries.
+        names = set(self.symbol_to_ids) | set(self.id_to_symbol) | set(self.gene_to_module)
+        self.keys = sorted((name.lower(), name) for name in names)
+        self.trigrams = defaultdict(set)
+        for position, (key, _) in enumerate(self.keys):
+            for k in range(len(key) - 2):
+                self.trigrams[key[k:k + 3]].add(position)
+
+    def __contains__(self, gene:str) -> bool:
+        return gene in self.id_to_symbol or gene in self.symbol_to_ids or gene in self.gene_to_module
+
+    def symbol(self, gene:str) -> str:
+        return self.id_to_symbol.get(gene, gene)
+
+    def ids(self, gene:str) -> list:
+        if gene in self.id_to_symbol:
+            return [gene]
+        return self.symbol_to_ids.get(gene, [])
+
+    def module(self, gene:str) -> str:
+        return self.gene_to_module.get(self.symbol(gene))
+
+    def label(self, gene:str) -> str:
+        parts = [self.symbol(gene)] + self.ids(gene)
+        module = self.module(gene)
+        if module:
+            parts.append(module)
+        return " · ".join(dict.fromkeys(parts))
+
+    def prefix(self, query:str, limit:int=20) -> list:
+        query = query.lower()
+        matches = []
+        position = bisect_left(self.keys, (query, ''))
+        while position < len(self.keys) and len(matches) < limit and self.keys[position][0].startswith(query):
+            matches.append(self.keys[position][1])
+            position += 1
+        return matches
+
+    def search(self, query:str, limit:int=20) -> list:
+        query = query.strip()
+        if not query:
+            return []
+        matches = self.prefix(query, limit)
+        if len(matches) >= limit or len(query) < 3:
+            return matches
+
+        key = query.lower()
+        candidates = set.intersection(*(self.trigrams.get(key[k:k + 3], set()) for k in range(len(key) - 2)))
+        seen = set(matches)
+        for position in sorted(candidates):
+            name = self.keys[position][1]
+            if name not in seen and key in self.keys[position][0]:
+                matches.append(name)
+                seen.add(name)
+                if len(matches) >= limit:
+                    break
+        return matches
@@ -0,0 +1,37 @@
+import re
+import subprocess
+import sys
+
+# Modules that must not be pulled in when the app starts (i.e. by `import lib`);
+# they are only imported by the pages/functions that need them.
+DEFERRED_MODULES = ['PyWGCNA', 'scipy.integrate', 'scipy.optimize', 'graphviz', 'matplotlib.pyplot', 'streamlit_pdf_viewer']
+
+def import_times(statement:str) -> dict:
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)', line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+    return times
+
+def report(statement:str, top:int=15) -> dict:
+    times = import_times(statement)
+    print(f"`{statement}`: {times.get(statement.split()[-1], 0) / 1e6:.3f} s cumulative")
+    for module, us in sorted(times.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"    {us / 1e6:8.3f} s  {module}")
+    return times
+
+if __name__ == '__main__':
+    startup = report('import lib')
+    regressions = [module for module in DEFERRED_MODULES if module in startup]
+
+    for page in ['stats', 'wgcna', 'network', 'dynamic']:
+        report(f'import {page}', top=5)
+
+    if regressions:
+        print(f"Heavy modules imported at startup: {', '.join(regressions)}")
+        sys.exit(1)
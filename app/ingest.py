@@ -0,0 +1,221 @@
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# Samples added after the original 12 live under ROOT: each batch has its own
+# metadata, count and TPM files, and the running per-gene and per-group
+# statistics are kept in derived/. The manifest is the commit point: it lists
+# the committed batches and names the derived files that belong to them, and it
+# is replaced atomically last. Files of a batch that failed half-way are never
+# referenced and are overwritten on retry.
+ROOT = 'data/samples'
+BATCH_DIR = os.path.join(ROOT, 'batches')
+DERIVED_DIR = os.path.join(ROOT, 'derived')
+MANIFEST = os.path.join(DERIVED_DIR, 'manifest.json')
+
+# Artefacts that have to be recomputed from scratch when their inputs grow.
+# The adjacency comes from a WGCNA run on the samples of its time, so it is
+# reported stale until a store is built from a run on the current samples
+# (adjacency.py --from-wgcna ... --current). It does not cascade: fits are made
+# on whichever network is in use.
+DEPENDENTS = {
+    'counts': ['deg'],
+    'tpm': ['adjacency', 'coexpression'],
+    'median_tpm': ['fits'],
+}
+
+def read_manifest() -> dict:
+    if not os.path.exists(MANIFEST):
+        return {'n_samples': 0, 'batches': [], 'stale': [], 'gene_stats': None, 'median_tpm': None}
+    with open(MANIFEST) as f:
+        return json.load(f)
+
+def write_manifest(manifest:dict) -> None:
+    os.makedirs(DERIVED_DIR, exist_ok=True)
+    tmp = f"{MANIFEST}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, MANIFEST)
+
+def stale_artefacts() -> list:
+    return read_manifest()['stale']
+
+def mark_stale(manifest:dict, changed:list) -> None:
+    pending = list(changed)
+    while pending:
+        for artefact in DEPENDENTS.get(pending.pop(), []):
+            if artefact not in manifest['stale']:
+                manifest['stale'].append(artefact)
+                pending.append(artefact)
+
+def data_version() -> str:
+    # Identifies the committed samples; artefacts computed under a different
+    # version were computed from different data.
+    return '+'.join(['base'] + read_manifest()['batches'])
+
+def mark_fresh(artefact:str) -> None:
+    manifest = read_manifest()
+    if artefact in manifest['stale']:
+        manifest['stale'].remove(artefact)
+        write_manifest(manifest)
+
+def batch_file(batch:str, kind:str) -> str:
+    return os.path.join(BATCH_DIR, f"{batch}_{kind}.txt")
+
+def derived_file(kind:str, version:int) -> str:
+    return os.path.join(DERIVED_DIR, f"{kind}-{version}.csv")
+
+def load_metadata(base:pd.DataFrame) -> pd.DataFrame:
+    added = [pd.read_csv(batch_file(batch, 'samples'))[base.columns] for batch in read_manifest()['batches']]
+    return pd.concat([base] + added, ignore_index=True) if added else base
+
+def load_counts(base:pd.DataFrame) -> pd.DataFrame:
+    for batch in read_manifest()['batches']:
+        base = base.merge(pd.read_csv(batch_file(batch, 'counts'), sep='\t'), on='Gene_ID', how='left')
+    return base
+
+def load_tpm(base:pd.DataFrame) -> pd.DataFrame:
+    batches = [pd.read_csv(batch_file(batch, 'tpm'), sep='\t', index_col=0) for batch in read_manifest()['batches']]
+    return base.join(batches, how='left') if batches else base
+
+def gene_stats(counts:pd.DataFrame) -> pd.DataFrame:
+    # Enough to update the per-gene count sums and the DESeq2 size-factor
+    # geometric means (exp of the mean log count, zero if any count is zero).
+    values = counts.values.astype(np.float64)
+    with np.errstate(divide='ignore'):
+        logs = np.where(values > 0, np.log(values), 0)
+    return pd.DataFrame({
+        'count_sum': values.sum(axis=1),
+        'log_sum': logs.sum(axis=1),
+        'any_zero': (values == 0).any(axis=1),
+    }, index=counts.index)
+
+def load_gene_stats() -> pd.DataFrame:
+    return pd.read_csv(read_manifest()['gene_stats'], index_col=0)
+
+def size_factor_geomeans() -> pd.Series:
+    stats = load_gene_stats()
+    geomeans = np.exp(stats['log_sum'] / read_manifest()['n_samples'])
+    return geomeans.where(~stats['any_zero'], 0)
+
+def load_median_tpm() -> pd.DataFrame:
+    return pd.read_csv(read_manifest()['median_tpm'], index_col=0)
+
+def group_medians(tpm:pd.DataFrame, metadata:pd.DataFrame, groups:set) -> pd.DataFrame:
+    columns = {}
+    for (time, treatment), group in metadata.groupby(['time', 'treatment']):
+        if (time, treatment) in groups:
+            columns[f"{time}_{treatment}"] = tpm[group['sample']].median(axis=1)
+    return pd.DataFrame(columns, index=tpm.index)
+
+def initialise(base_counts:pd.DataFrame, base_tpm:pd.DataFrame, base_metadata:pd.DataFrame) -> None:
+    # A single full pass over the original samples; later batches only touch
+    # their own columns.
+    os.makedirs(DERIVED_DIR, exist_ok=True)
+    gene_stats(base_counts.set_index('Gene_ID')).to_csv(derived_file('gene_stats', 0))
+    groups = set(zip(base_metadata['time'], base_metadata['treatment']))
+    group_medians(base_tpm, base_metadata, groups).sort_index(axis=1).to_csv(derived_file('median_tpm', 0))
+    write_manifest({
+        'n_samples': len(base_metadata),
+        'batches': [],
+        'stale': [],
+        'gene_stats': derived_file('gene_stats', 0),
+        'median_tpm': derived_file('median_tpm', 0),
+    })
+
+def ingest_samples(
+    batch:str,
+    counts:pd.DataFrame,
+    tpm:pd.DataFrame,
+    metadata:pd.DataFrame,
+    base_counts:pd.DataFrame,
+    base_tpm:pd.DataFrame,
+    base_metadata:pd.DataFrame
+) -> list:
+    if not os.path.exists(MANIFEST):
+        initialise(base_counts, base_tpm, base_metadata)
+    manifest = read_manifest()
+
+    if batch in manifest['batches']:
+        raise ValueError(f"Batch '{batch}' has already been ingested.")
+    existing = set(load_metadata(base_metadata)['sample'])
+    samples = metadata['sample'].tolist()
+    if existing.intersection(samples):
+        raise ValueError(f"Samples already ingested: {', '.join(sorted(existing.intersection(samples)))}")
+    for name, table in [('counts', counts), ('TPM', tpm)]:
+        if sorted(table.columns) != sorted(samples):
+            raise ValueError(f"The {name} columns must match the samples in the metadata.")
+
+    # Nothing below is visible to readers until the manifest is replaced.
+    version = len(manifest['batches']) + 1
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    counts[samples].to_csv(batch_file(batch, 'counts'), sep='\t', index_label='Gene_ID')
+    tpm[samples].to_csv(batch_file(batch, 'tpm'), sep='\t', index_label='Name')
+    metadata.to_csv(batch_file(batch, 'samples'), index=False)
+
+    # Per-gene statistics are sums, so the batch's own contribution is added.
+    stats = load_gene_stats()
+    added = gene_stats(counts[samples].reindex(stats.index, fill_value=0))
+    stats['count_sum'] += added['count_sum']
+    stats['log_sum'] += added['log_sum']
+    stats['any_zero'] |= added['any_zero']
+    stats.to_csv(derived_file('gene_stats', version))
+
+    # Medians are not decomposable, but only the groups the batch adds samples
+    # to are recomputed, from those groups' columns alone.
+    groups = set(zip(metadata['time'], metadata['treatment']))
+    full_metadata = pd.concat([load_metadata(base_metadata), metadata[base_metadata.columns]], ignore_index=True)
+    group_metadata = full_metadata[[group in groups for group in zip(full_metadata['time'], full_metadata['treatment'])]]
+    group_tpm = base_tpm[[sample for sample in group_metadata['sample'] if sample in base_tpm.columns]]
+    for previous in manifest['batches']:
+        previous_tpm = pd.read_csv(batch_file(previous, 'tpm'), sep='\t', index_col=0)
+        group_tpm = group_tpm.join(previous_tpm[[sample for sample in previous_tpm.columns if sample in set(group_metadata['sample'])]])
+    group_tpm = group_tpm.join(tpm[samples])
+    median_tpm = load_median_tpm()
+    updated = group_medians(group_tpm, group_metadata, groups).reindex(median_tpm.index)
+    for column in updated.columns:
+        median_tpm[column] = updated[column]
+    median_tpm.sort_index(axis=1).to_csv(derived_file('median_tpm', version))
+
+    previous = [manifest['gene_stats'], manifest['median_tpm']]
+    manifest['n_samples'] += len(samples)
+    manifest['batches'].append(batch)
+    manifest['gene_stats'] = derived_file('gene_stats', version)
+    manifest['median_tpm'] = derived_file('median_tpm', version)
+    mark_stale(manifest, ['counts', 'tpm', 'median_tpm'])
+    write_manifest(manifest)
+
+    for path in previous:
+        if os.path.exists(path):
+            os.remove(path)
+    return manifest['stale']
+
+if __name__ == '__main__':
+    import lib
+
+    parser = argparse.ArgumentParser(description="Add a batch of new samples to the dataset.")
+    parser.add_argument('batch', help="Name of the batch, e.g. day_8.")
+    parser.add_argument('--counts', required=True, help="Raw counts (tab separated, Gene_ID then one column per sample).")
+    parser.add_argument('--tpm', required=True, help="TPM values (tab separated, gene name then one column per sample).")
+    parser.add_argument('--metadata', required=True, help="Sample metadata csv with sample, time and treatment columns.")
+    args = parser.parse_args()
+
+    paths = [os.path.abspath(path) for path in (args.counts, args.tpm, args.metadata)]
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    stale = ingest_samples(
+        args.batch,
+        pd.read_csv(paths[0], sep='\t', index_col=0),
+        pd.read_csv(paths[1], sep='\t', index_col=0),
+        pd.read_csv(paths[2]),
+        pd.read_csv('data/E-GEOD-46730-raw-counts.txt', sep='\t'),
+        pd.read_csv('data/GSE46730_RNA-seq-Nianwei.txt', sep='\t', index_col=0),
+        lib.BASE_METADATA
+    )
+    print(f"Ingested batch '{args.batch}'. Stale artefacts to recompute: {', '.join(stale) or 'none'}")
+    if 'adjacency' in stale:
+        print(
+            "The WGCNA network no longer reflects all samples. Re-run WGCNA on the combined data and rebuild "
+            "the store with: python adjacency.py data/wgcna/adjacency/modules --from-wgcna <object> --modules <names> --current"
+        )
@@ -1,36 +1,86 @@
+from __future__ import annotations
 import os
 import subprocess
 from types import FunctionType
+from typing import TYPE_CHECKING
 import pandas as pd
-import PyWGCNA
 import streamlit as st
 import numpy as np
-from scipy.integrate import odeint
-from scipy.optimize import minimize, OptimizeResult
-import graphviz
+import adjacency
+import geneindex
+import coexpr
+import ingest
+
+# PyWGCNA, SciPy and Graphviz are slow to import, so they are imported inside
+# the functions that use them rather than at module load.
+if TYPE_CHECKING:
+    import graphviz
+    import PyWGCNA
+    from scipy.optimize import OptimizeResult
+
+# The original sample design; samples ingested later are appended by ingest.py.
+BASE_METADATA = pd.DataFrame({
+    'sample': ["SRR847690", "SRR847691", "SRR847692", "SRR847693", "SRR847694", "SRR847695", "SRR847696", "SRR847697", "SRR847698", "SRR847699", "SRR847700", "SRR847701"],
+    'time': ["day_2", "day_2", "day_2", "day_2", "day_2", "day_2", "day_4", "day_4", "day_4", "day_6", "day_6", "day_6"],
+    'treatment': ["control", "control", "control", "treated", "treated", "treated", "treated", "treated", "treated", "treated", "treated", "treated"]
+})
 
 def generate_deg() -> None:
-    if os.path.exists('data/DESeq2_combined_results.csv'):
+    if os.path.exists('data/DESeq2_combined_results.txt') and 'deg' not in ingest.stale_artefacts():
         pass
     else:
-        subprocess.run(['Rscript', 'deseq.R'])
+        # deseq.R is given the committed batches, so it never picks up the files
+        # of a batch whose ingestion did not finish.
+        subprocess.run(['Rscript', 'deseq.R'] + ingest.read_manifest()['batches'], check=True)
+        ingest.mark_fresh('deg')
+
+def load_metadata() -> pd.DataFrame:
+    return ingest.load_metadata(BASE_METADATA.copy())
+
+@st.cache_resource
+def load_adjacency_store() -> adjacency.AdjacencyStore:
+    # The store is memory-mapped and read-only, so one instance is shared by
+    # every session. It is built from the maroon csv the first time it is needed.
+    if not os.path.exists('data/wgcna/adjacency/modules.json'):
+        os.makedirs('data/wgcna/adjacency', exist_ok=True)
+        maroon = pd.read_csv('data/wgcna/figures/maroon_adjmat.csv', index_col=0)
+        adjacency.write_store(maroon, 'data/wgcna/adjacency/modules', {'maroon': maroon.index.tolist()})
+    return adjacency.AdjacencyStore('data/wgcna/adjacency/modules')
+
+@st.cache_resource
+def load_gene_index() -> geneindex.GeneIndex:
+    mart = pd.read_csv('data/mart_export.txt', sep='\t')
+    hyp = pd.read_csv('data/wgcna/figures/top_20_hub_genes_maroon.csv', index_col=0)
+
+    modules = dict(load_adjacency_store().modules)
+    for module, genes in hyp.groupby('moduleColors').groups.items():
+        modules[module] = list(dict.fromkeys(modules.get(module, []) + genes.tolist()))
+
+    return geneindex.GeneIndex(mart, modules)
+
+@st.cache_resource
+def load_coexpression_index(data_version:str) -> coexpr.CoexpressionIndex:
+    # data_version (ingest.data_version()) is only the cache key, so a running
+    # server builds a new index once samples have been ingested.
+    tpm = ingest.load_tpm(pd.read_csv('data/GSE46730_RNA-seq-Nianwei.txt', sep='\t', index_col=0))
+    index = coexpr.CoexpressionIndex(tpm)
+    ingest.mark_fresh('coexpression')
+    return index
 
 def load_data() -> tuple:
     generate_deg()
     return (
         pd.read_csv('data/DESeq2_combined_results.txt', sep='\t'),
-        pd.read_csv('data/E-GEOD-46730-raw-counts.txt', sep='\t'),
-        pd.read_csv('data/GSE46730_RNA-seq-Nianwei.txt', sep='\t', index_col=0),
-        pd.read_csv('data/wgcna/figures/maroon_adjmat.csv', index_col=0),
-        pd.DataFrame({
-            'sample': ["SRR847690", "SRR847691", "SRR847692", "SRR847693", "SRR847694", "SRR847695", "SRR847696", "SRR847697", "SRR847698", "SRR847699", "SRR847700", "SRR847701"],
-            'time': ["day_2", "day_2", "day_2", "day_2", "day_2", "day_2", "day_4", "day_4", "day_4", "day_6", "day_6", "day_6"],
-            'treatment': ["control", "control", "control", "treated", "treated", "treated", "treated", "treated", "treated", "treated", "treated", "treated"]
-        }),
+        ingest.load_counts(pd.read_csv('data/E-GEOD-46730-raw-counts.txt', sep='\t')),
+        ingest.load_tpm(pd.read_csv('data/GSE46730_RNA-seq-Nianwei.txt', sep='\t', index_col=0)),
+        load_adjacency_store().module('maroon').astype(float),
+        load_metadata(),
         pd.read_csv('data/wgcna/figures/top_20_hub_genes_maroon.csv', index_col=0),
     )
 
 def init_wgcna(expr_data:pd.DataFrame) -> PyWGCNA.WGCNA:
+    import PyWGCNA
+
     obj = PyWGCNA.WGCNA(
         geneExp = expr_data,
         name = 'TUNA_kd',
@@ -61,15 +111,11 @@ def gene_network_dynamics(
     adj_matrix:np.ndarray,
     params:np.ndarray
 ) -> np.ndarray:
-    dydt = np.zeros(len(y))
-    for i in range(len(y)):
-        interaction_sum = 0
-        for j in range(len(y)):
-            interaction_sum += adj_matrix[i, j] * y[j]
-        r_i = params[i]
-        K_i = params[len(y) + i]
-        dydt[i] = r_i * y[i] * (1 - y[i] / K_i) + interaction_sum
-    return dydt
+    # Logistic growth of each gene plus the adjacency-weighted expression of
+    # the genes it interacts with, for all genes at once.
+    r = params[:len(y)]
+    K = params[len(y):]
+    return r * y * (1 - y / K) + adj_matrix @ y
 
 def objective_function(
     params:np.ndarray,
@@ -102,17 +148,260 @@ def calculate_median_tpm(tpm:pd.DataFrame, metadata:pd.DataFrame) -> pd.DataFram
     median_tpm_wide.columns = [f"{time}_{treatment}" for time, treatment in median_tpm_wide.columns]
     return median_tpm_wide
 
+def load_median_tpm(tpm:pd.DataFrame, metadata:pd.DataFrame) -> pd.DataFrame:
+    # Once samples have been ingested, ingest.py keeps the group medians up to
+    # date, so they are read rather than recomputed over the whole matrix.
+    if os.path.exists(ingest.MANIFEST):
+        return ingest.load_median_tpm()
+    return calculate_median_tpm(tpm, metadata)
+
 def optimize_params(
     objective_function:FunctionType,
     initial_params:np.ndarray,
     adj_matrix:np.ndarray,
     initial_conditions:np.ndarray,
     time_points:np.ndarray,
-    observed_data:pd.DataFrame
+    observed_data:pd.DataFrame,
+    options:dict=None
 ) -> OptimizeResult:
-    result = minimize(objective_function, initial_params, args=(adj_matrix, initial_conditions, time_points, observed_data))
+    from scipy.optimize import minimize
+
+    result = minimize(objective_function, initial_params, args=(adj_matrix, initial_conditions, time_points, observed_data), options=options)
     return result
 
+def fit_gene_set(
+    genes:list,
+    median_tpm:pd.DataFrame,
+    adjmat:pd.DataFrame,
+    decay_rate:float=0.5,
+    carrying_capacity:float=10.0,
+    options:dict=None,
+    initial_params:np.ndarray=None
+) -> OptimizeResult:
+    observed_data = median_tpm.loc[genes]
+    init_conditions = observed_data.iloc[:, 0].values
+    if initial_params is None:
+        init_params = np.concatenate([np.ones(len(genes)) * decay_rate, np.ones(len(genes)) * carrying_capacity])
+    else:
+        init_params = initial_params
+    observed_time_points = np.arange(observed_data.shape[1])
+
+    return optimize_params(
+        objective_function,
+        init_params,
+        adjmat.loc[genes, genes].values,
+        init_conditions,
+        observed_time_points,
+        observed_data,
+        options
+    )
+
+# The joint refinement after a block fit uses finite-difference gradients, which
+# cost 2N + 1 integrations of the full N-gene model per iteration.
+REFINE_MAX_GENES = 50
+
+def partition_genes(adjmat:pd.DataFrame, threshold:float, max_block_size:int=None) -> list:
+    from scipy.sparse.csgraph import connected_components
+
+    # Blocks are the connected components of the graph of edges heavier than
+    # the threshold. Blocks that are still too large are split again using the
+    # median of their own edge weights, which always drops at least half of them.
+    values = adjmat.values
+    n_blocks, labels = connected_components(values > threshold, directed=False)
+    blocks = []
+    for block in range(n_blocks):
+        genes = adjmat.index[labels == block].tolist()
+        if max_block_size and len(genes) > max_block_size:
+            weights = adjmat.loc[genes, genes].values
+            blocks += partition_genes(adjmat.loc[genes, genes], np.median(weights[weights > threshold]), max_block_size)
+        else:
+            blocks.append(genes)
+    return blocks
+
+def block_adjacency(adjmat:pd.DataFrame, blocks:list) -> pd.DataFrame:
+    # The adjacency a block fit actually models: weights between genes of
+    # different blocks are zero.
+    block_of = {gene: i for i, block in enumerate(blocks) for gene in block}
+    labels = adjmat.index.map(block_of).values
+    return adjmat.where(labels[:, None] == labels[None, :], 0)
+
+def fit_gene_set_blocks(
+    genes:list,
+    median_tpm:pd.DataFrame,
+    adjmat:pd.DataFrame,
+    decay_rate:float=0.5,
+    carrying_capacity:float=10.0,
+    threshold:float=0.3,
+    max_block_size:int=None,
+    refine_iter:int=0,
+    workers:int=None,
+    options:dict=None,
+    initial_params:np.ndarray=None
+) -> OptimizeResult:
+    from concurrent.futures import ProcessPoolExecutor
+    from scipy.optimize import OptimizeResult, minimize
+
+    if refine_iter and len(genes) > REFINE_MAX_GENES:
+        raise ValueError(f"Joint refinement is limited to {REFINE_MAX_GENES} genes, got {len(genes)}.")
+
+    blocks = partition_genes(adjmat.loc[genes, genes], threshold, max_block_size)
+    # Starting values given in the [r..., K...] layout of genes are split up by block.
+    block_params = [None] * len(blocks)
+    if initial_params is not None:
+        position = {gene: i for i, gene in enumerate(genes)}
+        block_params = [
+            np.concatenate([initial_params[[position[gene] for gene in block]], initial_params[[len(genes) + position[gene] for gene in block]]])
+            for block in blocks
+        ]
+    args = (
+        blocks,
+        [median_tpm.loc[block] for block in blocks],
+        [adjmat.loc[block, block] for block in blocks],
+        [decay_rate] * len(blocks),
+        [carrying_capacity] * len(blocks),
+        [options] * len(blocks),
+        block_params
+    )
+    if workers == 1:
+        block_results = list(map(fit_gene_set, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            block_results = list(pool.map(fit_gene_set, *args))
+
+    # Reassemble the block estimates into the [r..., K...] layout of the joint fit.
+    fitted = {}
+    for block, block_result in zip(blocks, block_results):
+        for i, gene in enumerate(block):
+            fitted[gene] = (block_result.x[i], block_result.x[len(block) + i])
+    x = np.array([fitted[gene][0] for gene in genes] + [fitted[gene][1] for gene in genes])
+
+    # The blocks were fitted without the weights between them, so unless the
+    # estimates are refined on the full adjacency they describe the
+    # block-diagonal model and have to be integrated under it; `adj_matrix` is
+    # the matrix the parameters belong to.
+    observed_data = median_tpm.loc[genes]
+    if refine_iter:
+        adj_matrix = adjmat.loc[genes, genes].values
+    else:
+        adj_matrix = block_adjacency(adjmat.loc[genes, genes], blocks).values
+    args = (adj_matrix, observed_data.iloc[:, 0].values, np.arange(observed_data.shape[1]), observed_data)
+    if refine_iter:
+        x = minimize(objective_function, x, args=args, options={'maxiter': refine_iter}).x
+
+    fun = objective_function(x, *args)
+    success = all(block_result.success for block_result in block_results)
+    message = ''
+    block_loss = sum(block_result.fun for block_result in block_results)
+    if not refine_iter and not np.isclose(fun, block_loss, rtol=1e-2):
+        # The block-diagonal model is the blocks side by side, so anything more
+        # than integration error means the estimates do not hold together.
+        success = False
+        message = f"Loss of the assembled model ({fun:.4g}) differs from the summed block losses ({block_loss:.4g})."
+
+    return OptimizeResult(
+        x=x,
+        fun=fun,
+        success=success,
+        message=message,
+        blocks=blocks,
+        refined=bool(refine_iter),
+        adj_matrix=adj_matrix
+    )
+
+def resample_median_tpm(tpm:pd.DataFrame, metadata:pd.DataFrame, rng:np.random.Generator) -> pd.DataFrame:
+    # Resample replicates with replacement within each time/treatment group,
+    # keeping the column order of calculate_median_tpm.
+    columns = {}
+    for (time, treatment), group in metadata.groupby(['time', 'treatment']):
+        samples = rng.choice(group['sample'].values, size=len(group), replace=True)
+        columns[f"{time}_{treatment}"] = tpm[samples].median(axis=1)
+    return pd.DataFrame(columns, index=tpm.index)
+
+def bootstrap_worker(
+    seed:int,
+    tpm:pd.DataFrame,
+    metadata:pd.DataFrame,
+    adjmat:pd.DataFrame,
+    point_estimate:np.ndarray,
+    maxiter:int,
+    block_threshold:float=None,
+    decay_rate:float=0.5,
+    carrying_capacity:float=10.0,
+    refine_iter:int=0
+) -> tuple:
+    observed_data = resample_median_tpm(tpm, metadata, np.random.default_rng(seed))
+    genes = observed_data.index.tolist()
+    if block_threshold is None:
+        result = optimize_params(
+            objective_function,
+            point_estimate,
+            adjmat.values,
+            observed_data.iloc[:, 0].values,
+            np.arange(observed_data.shape[1]),
+            observed_data,
+            options={'maxiter': maxiter}
+        )
+    else:
+        # Already running inside the bootstrap pool, so the blocks are fitted
+        # serially, with the same blocks and refinement as the point fit.
+        result = fit_gene_set_blocks(
+            genes, observed_data, adjmat, decay_rate, carrying_capacity, block_threshold,
+            max_block_size=20, refine_iter=refine_iter, workers=1, options={'maxiter': maxiter},
+            initial_params=point_estimate
+        )
+    # The resample's own day 2 medians are its initial conditions, so prediction
+    # bands are integrated from them rather than from the point estimate's.
+    return result.x, observed_data.iloc[:, 0].values
+
+def bootstrap_fit(
+    genes:list,
+    tpm:pd.DataFrame,
+    metadata:pd.DataFrame,
+    adjmat:pd.DataFrame,
+    point_estimate:np.ndarray,
+    n_boot:int=20,
+    workers:int=None,
+    seed:int=0,
+    maxiter:int=50,
+    block_threshold:float=None,
+    decay_rate:float=0.5,
+    carrying_capacity:float=10.0,
+    refine_iter:int=0
+) -> tuple:
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Each refit is independent, capped at maxiter iterations and warm-started
+    # from the point estimate, so the resamples are spread over a process pool,
+    # one task per resample.
+    seeds = [s.generate_state(1)[0] for s in np.random.SeedSequence(seed).spawn(n_boot)]
+    tpm_genes = tpm.loc[genes]
+    adj_genes = adjmat.loc[genes, genes]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        refits = list(pool.map(
+            bootstrap_worker,
+            seeds,
+            [tpm_genes] * n_boot,
+            [metadata] * n_boot,
+            [adj_genes] * n_boot,
+            [point_estimate] * n_boot,
+            [maxiter] * n_boot,
+            [block_threshold] * n_boot,
+            [decay_rate] * n_boot,
+            [carrying_capacity] * n_boot,
+            [refine_iter] * n_boot
+        ))
+    samples = np.array([params for params, _ in refits])
+    initial_conditions = np.array([conditions for _, conditions in refits])
+    return samples, initial_conditions
+
+def bootstrap_intervals(samples:np.ndarray, genes:list, level:float=0.95) -> pd.DataFrame:
+    n = len(genes)
+    low, high = np.percentile(samples, [100 * (1 - level) / 2, 100 * (1 + level) / 2], axis=0)
+    return pd.DataFrame({
+        'r_low': low[:n], 'r_high': high[:n],
+        'K_low': low[n:], 'K_high': high[n:],
+    }, index=genes)
+
 def integrate_model(
     gene_network_dynamics:FunctionType,
     initial_conditions:np.ndarray,
@@ -120,9 +409,26 @@ def integrate_model(
     adj_matrix:np.ndarray,
     params:np.ndarray
 ):
+    from scipy.integrate import odeint
+
     solution = odeint(gene_network_dynamics, initial_conditions, time_points, args=(adj_matrix, params))
     return solution
 
+def perturbation_sweep(
+    adj_matrix:np.ndarray,
+    initial_conditions:np.ndarray,
+    time_points:np.ndarray,
+    params:np.ndarray,
+    index:int,
+    values:np.ndarray
+) -> np.ndarray:
+    trajectories = []
+    for value in values:
+        perturbed = params.copy()
+        perturbed[index] = value
+        trajectories.append(integrate_model(gene_network_dynamics, initial_conditions, time_points, adj_matrix, perturbed))
+    return np.array(trajectories)
+
 def transform_df(df):
     melted_df = pd.melt(df, id_vars=['Gene_ID', 'Gene_name'], var_name='contrast', value_name='value')
     melted_df[['contrast', 'measurement']] = melted_df['contrast'].str.rsplit('.', n=1, expand=True)
@@ -134,7 +440,9 @@ def transform_df(df):
 
     return reshaped_df
 
-def create_graphviz_graph(adj_matrix):
+def create_graphviz_graph(adj_matrix) -> graphviz.Digraph:
+    import graphviz
+
     graph = graphviz.Digraph()
 
     # Add nodes
@@ -0,0 +1,128 @@
+import argparse
+import os
+import resource
+import threading
+import time
+import numpy as np
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Each simulated session runs this script, which dispatches to the same page
+# functions main.py navigates between. The page is chosen through session
+# state so one AppTest (one session) can visit several pages in turn.
+SCRIPT = """
+import streamlit as st
+import lib
+
+lib.initialize_data()
+page = st.session_state.get('loadtest_page', 'home')
+if page == 'stats':
+    import stats
+    stats.stats_page()
+elif page == 'wgcna':
+    import wgcna
+    wgcna.wgcna_page()
+elif page == 'network':
+    import network
+    network.network_page()
+elif page == 'dynamic':
+    import dynamic
+    dynamic.dynamic_page()
+"""
+
+DEFAULT_STEPS = ['home', 'stats', 'wgcna', 'network', 'dynamic', 'dynamic:run']
+
+def rss_mb() -> float:
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_step(at:AppTest, step:str) -> None:
+    page, _, action = step.partition(':')
+    at.session_state['loadtest_page'] = page
+    if action == 'run':
+        # Submitting the model form re-runs the page with the fit.
+        buttons = [button for button in at.button if button.label == 'Run model']
+        if not buttons:
+            raise RuntimeError(f"{step}: no 'Run model' button on the current page; '{step}' must come right after a 'dynamic' step")
+        buttons[0].click().run()
+    else:
+        at.run()
+    if at.exception:
+        raise RuntimeError(f"{step}: {at.exception[0].message}")
+
+def session(steps:list, iterations:int, records:list, timeout:float) -> None:
+    at = AppTest.from_string(SCRIPT, default_timeout=timeout)
+    at.run()
+    for _ in range(iterations):
+        for step in steps:
+            # Failed reruns are timed too, so errors cannot make latency look better.
+            start = time.perf_counter()
+            try:
+                run_step(at, step)
+                error = None
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            records.append({'step': step, 'seconds': time.perf_counter() - start, 'error': error})
+
+def summarise(records:pd.DataFrame) -> dict:
+    return {
+        'reruns': len(records),
+        'errors': int(records['error'].notna().sum()),
+        'p50_s': np.percentile(records['seconds'], 50) if len(records) else np.nan,
+        'p95_s': np.percentile(records['seconds'], 95) if len(records) else np.nan,
+    }
+
+def load_test(n_sessions:int, steps:list, iterations:int, timeout:float) -> tuple:
+    records = []
+    threads = [
+        threading.Thread(target=session, args=(steps, iterations, records, timeout))
+        for _ in range(n_sessions)
+    ]
+    peak_rss = rss_mb()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        peak_rss = max(peak_rss, rss_mb())
+        time.sleep(0.1)
+    wall = time.perf_counter() - start
+
+    records = pd.DataFrame(records, columns=['step', 'seconds', 'error'])
+    rows = [dict(sessions=n_sessions, step='all', **summarise(records), throughput_per_s=len(records) / wall, peak_rss_mb=peak_rss)]
+    for step in dict.fromkeys(steps):
+        rows.append(dict(sessions=n_sessions, step=step, **summarise(records[records['step'] == step])))
+    return rows, records['error'].dropna()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulate concurrent app sessions and report rerun latency, throughput and memory.")
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 2, 4, 8], help="Numbers of concurrent sessions to test.")
+    parser.add_argument('--steps', nargs='+', default=DEFAULT_STEPS, help="Page visits per iteration; 'dynamic:run' submits the model form.")
+    parser.add_argument('--iterations', type=int, default=1, help="Times each session repeats the steps.")
+    parser.add_argument('--timeout', type=float, default=600, help="Timeout in seconds for a single rerun.")
+    parser.add_argument('--output', help="Optional csv to write the report to.")
+    args = parser.parse_args()
+
+    os.chdir(APP_DIR)
+    rows, errors = [], {}
+    for n in args.sessions:
+        n_rows, n_errors = load_test(n, args.steps, args.iterations, args.timeout)
+        rows += n_rows
+        for message, count in n_errors.value_counts().items():
+            errors[(n, message)] = count
+
+    report = pd.DataFrame(rows)
+    print(report.to_string(index=False, na_rep='', float_format=lambda value: f"{value:.3f}"))
+    if errors:
+        print("\nErrors:")
+        for (n, message), count in errors.items():
+            print(f"  [{n} sessions] {count}x {message}")
+    if args.output:
+        report.to_csv(args.output, index=False)
@@ -1,10 +1,23 @@
 import streamlit as st
-import pandas as pd
 import lib
-import stats
-import wgcna
-import dynamic
-import network
+
+# Page modules (and their heavy dependencies) are imported on first visit only,
+# so a rerun of the Home page never pays for WGCNA, SciPy or Graphviz.
+def stats_page():
+    import stats
+    stats.stats_page()
+
+def wgcna_page():
+    import wgcna
+    wgcna.wgcna_page()
+
+def network_page():
+    import network
+    network.network_page()
+
+def dynamic_page():
+    import dynamic
+    dynamic.dynamic_page()
 
 def home():
     st.set_page_config(layout="wide")
@@ -45,9 +58,9 @@ def home():
 
 pg = st.navigation([
     st.Page(home, title="Home", icon="🏠"),
-    st.Page(stats.stats_page, title="Statistical Modelling", icon="📊"),
-    st.Page(wgcna.wgcna_page, title="WGCNA", icon="📊"),
-    st.Page(network.network_page, title="Network Analysis", icon="📊"),
-    st.Page(dynamic.dynamic_page, title="Dynamic Modelling", icon="📊")
+    st.Page(stats_page, title="Statistical Modelling", icon="📊"),
+    st.Page(wgcna_page, title="WGCNA", icon="📊"),
+    st.Page(network_page, title="Network Analysis", icon="📊"),
+    st.Page(dynamic_page, title="Dynamic Modelling", icon="📊")
 ])
 pg.run()
@@ -7,7 +7,6 @@ def network_page():
     if not 'adjmat' or not 'hyp' in st.session_state:
         st.error("Please load the data first. Head to the home page, then come back here.")
 
-    adjmat = st.session_state.adjmat
     hyp = st.session_state.hyp
 
     st.write(
@@ -101,8 +100,10 @@ def network_page():
 
     st.dataframe(hyp.drop(columns=['gene_name', 'gene_biotype']))
 
+    store = lib.load_adjacency_store()
+
     genes = hyp.index.tolist()
-    to_genes = adjmat.loc[genes, genes]
+    to_genes = store.submatrix(genes)
 
     graph_1 = lib.create_graphviz_graph(to_genes)
 
@@ -117,7 +118,7 @@ def network_page():
     )
 
     genes = hyp.index.tolist()[2:]
-    to_genes = adjmat.loc[genes, genes]
+    to_genes = store.submatrix(genes)
 
     graph = lib.create_graphviz_graph(to_genes)
 
@@ -134,3 +135,34 @@ def network_page():
         the top genes.
         """
     )
+
+    st.write(
+        """
+        ***
+
+        #### Module adjacency explorer
+
+        The adjacency of every stored module is kept on disk and read on demand, so networks can be built live for \
+        any combination of modules. Select the modules, the number of most connected genes per module, and the \
+        minimum edge weight to draw:
+        """
+    )
+
+    with st.form('Adjacency explorer'):
+        modules = st.multiselect('Modules', list(store.modules), list(store.modules))
+        top_n = st.number_input('Genes per module', min_value=2, max_value=50, value=10)
+        threshold = st.slider('Minimum edge weight', 0.0, 1.0, 0.3)
+
+        submitted = st.form_submit_button('Build network')
+
+        if submitted and modules:
+            genes = []
+            for module in modules:
+                module_genes = store.modules[module]
+                connectivity = store.submatrix(module_genes).sum(axis=1)
+                genes += connectivity.nlargest(top_n).index.tolist()
+
+            to_genes = store.submatrix(genes)
+            to_genes = to_genes.where(to_genes >= threshold, 0)
+
+            st.graphviz_chart(lib.create_graphviz_graph(to_genes).source)
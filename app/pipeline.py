@@ -0,0 +1,280 @@
+import argparse
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import ingest
+import lib
+import results
+
+STAGES = ['deg', 'median', 'fit', 'sweep']
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def write_json(path:str, data:dict) -> None:
+    # Write to a temporary file first so an interrupted run never leaves a
+    # truncated checkpoint behind.
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+def load_gene_sets(path:str, hyp:pd.DataFrame) -> dict:
+    if path is None:
+        return {'maroon_hub_top10': hyp.index.tolist()[0:10]}
+    with open(path) as f:
+        return json.load(f)
+
+def prediction_time(days:int) -> np.ndarray:
+    return np.linspace(0, days, days * 10 + 1)
+
+def fit_worker(name:str, genes:list, median_tpm:pd.DataFrame, adjmat:pd.DataFrame, decay_rate:float, carrying_capacity:float, days:int, block_threshold:float=None, refine_iter:int=0) -> dict:
+    start = time.perf_counter()
+    if block_threshold is None:
+        result = lib.fit_gene_set(genes, median_tpm, adjmat, decay_rate, carrying_capacity)
+    else:
+        # Gene sets already run in parallel, so the blocks of one set are fitted serially.
+        result = lib.fit_gene_set_blocks(genes, median_tpm, adjmat, decay_rate, carrying_capacity, block_threshold, max_block_size=20, refine_iter=refine_iter, workers=1)
+    return {
+        'name': name,
+        'genes': genes,
+        'r': result.x[:len(genes)].tolist(),
+        'K': result.x[len(genes):].tolist(),
+        'loss': float(result.fun),
+        'success': bool(result.success),
+        'message': str(result.get('message', '')),
+        'blocks': result.get('blocks'),
+        'refined': bool(result.get('refined')),
+        'seconds': time.perf_counter() - start,
+        'trajectory': lib.integrate_model(
+            lib.gene_network_dynamics,
+            median_tpm.loc[genes].iloc[:, 0].values,
+            prediction_time(days),
+            result.get('adj_matrix', adjmat.loc[genes, genes].values),
+            result.x
+        ),
+    }
+
+def sweep_worker(fit:dict, median_tpm:pd.DataFrame, adjmat:pd.DataFrame, days:int, factors:list) -> list:
+    # Each gene's carrying capacity is scaled by every factor in turn, with all
+    # other parameters held at their fitted values.
+    genes = fit['genes']
+    params = np.array(fit['r'] + fit['K'])
+    adj_matrix = adjmat.loc[genes, genes]
+    if fit.get('blocks') and not fit.get('refined'):
+        adj_matrix = lib.block_adjacency(adj_matrix, fit['blocks'])
+    sweeps = []
+    for i, gene in enumerate(genes):
+        values = params[len(genes) + i] * np.array(factors)
+        trajectories = lib.perturbation_sweep(
+            adj_matrix.values,
+            median_tpm.loc[genes].iloc[:, 0].values,
+            prediction_time(days),
+            params,
+            len(genes) + i,
+            values
+        )
+        sweeps.append((gene, values, trajectories))
+    return sweeps
+
+def read_json(path:str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+def checkpoint_valid(out:str, stage:str, target:str, force:bool, artefact:str=None) -> bool:
+    # A checkpoint only counts if it was written for the current samples (see
+    # ingest.data_version) and its artefact has not been marked stale since.
+    if force or not os.path.exists(target):
+        return False
+    versions_path = os.path.join(out, 'checkpoints.json')
+    versions = read_json(versions_path) if os.path.exists(versions_path) else {}
+    return versions.get(stage) == ingest.data_version() and artefact not in ingest.stale_artefacts()
+
+def record_checkpoint(out:str, stage:str) -> None:
+    versions_path = os.path.join(out, 'checkpoints.json')
+    versions = read_json(versions_path) if os.path.exists(versions_path) else {}
+    versions[stage] = ingest.data_version()
+    write_json(versions_path, versions)
+
+def load_project_tpm() -> pd.DataFrame:
+    return ingest.load_tpm(pd.read_csv('data/GSE46730_RNA-seq-Nianwei.txt', sep='\t', index_col=0))
+
+def run_deg(out:str, force:bool) -> None:
+    target = os.path.join(out, 'DESeq2_combined_results.txt')
+    if checkpoint_valid(out, 'deg', target, force, 'deg'):
+        print(f"[deg] checkpoint found, skipping: {target}")
+        return
+    lib.generate_deg()
+    shutil.copyfile('data/DESeq2_combined_results.txt', target)
+    record_checkpoint(out, 'deg')
+    print(f"[deg] wrote {target}")
+
+def run_median(out:str, force:bool, tpm:pd.DataFrame=None) -> pd.DataFrame:
+    target = os.path.join(out, 'median_tpm.csv')
+    if checkpoint_valid(out, 'median', target, force):
+        print(f"[median] checkpoint found, loading: {target}")
+        return pd.read_csv(target, index_col=0)
+    if tpm is None and os.path.exists(ingest.MANIFEST):
+        # Kept up to date by ingest.py, no pass over the TPM matrix needed.
+        median_tpm = ingest.load_median_tpm()
+    elif tpm is None:
+        median_tpm = lib.calculate_median_tpm(load_project_tpm(), lib.load_metadata())
+    else:
+        median_tpm = lib.calculate_median_tpm(tpm, lib.load_metadata())
+    median_tpm.to_csv(target)
+    record_checkpoint(out, 'median')
+    print(f"[median] wrote {target}")
+    return median_tpm
+
+def run_fit(out:str, force:bool, gene_sets:dict, median_tpm:pd.DataFrame, adjmat:pd.DataFrame, args:argparse.Namespace) -> bool:
+    fits_dir = os.path.join(out, 'fits')
+    os.makedirs(fits_dir, exist_ok=True)
+
+    pending = {}
+    for name, genes in gene_sets.items():
+        target = os.path.join(fits_dir, f"{name}.json")
+        if (
+            os.path.exists(target) and not force
+            and read_json(target).get('data_version') == ingest.data_version()
+            and 'fits' not in ingest.stale_artefacts()
+        ):
+            print(f"[fit] checkpoint found, skipping: {name}")
+            continue
+        missing = [gene for gene in genes if gene not in adjmat.index or gene not in median_tpm.index]
+        if missing:
+            print(f"[fit] skipping {name}, genes not in module/TPM data: {', '.join(missing)}")
+            continue
+        if args.refine_iter and args.block_threshold is not None and len(genes) > lib.REFINE_MAX_GENES:
+            print(f"[fit] {name} has more than {lib.REFINE_MAX_GENES} genes, its blocks are not refined")
+        pending[name] = genes
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(
+                fit_worker, name, genes,
+                median_tpm.loc[genes], adjmat.loc[genes, genes],
+                args.decay_rate, args.carrying_capacity, args.days, args.block_threshold,
+                args.refine_iter if len(genes) <= lib.REFINE_MAX_GENES else 0
+            ): name
+            for name, genes in pending.items()
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            result['data_version'] = ingest.data_version()
+            result['run_id'] = results.write_fit(
+                result['name'],
+                result['genes'],
+                np.array(result['r'] + result['K']),
+                prediction_time(args.days),
+                result.pop('trajectory'),
+                path=os.path.join(out, 'results.h5'),
+                loss=result['loss'],
+                decay_rate=args.decay_rate,
+                carrying_capacity=args.carrying_capacity
+            )
+            write_json(os.path.join(fits_dir, f"{result['name']}.json"), result)
+            print(f"[fit] {result['name']}: loss={result['loss']:.4g} ({result['seconds']:.1f} s)")
+
+    # True only if every requested gene set was fitted in this run.
+    return set(pending) == set(gene_sets)
+
+def run_sweep(out:str, force:bool, gene_sets:dict, median_tpm:pd.DataFrame, adjmat:pd.DataFrame, args:argparse.Namespace) -> None:
+    fits_dir = os.path.join(out, 'fits')
+    sweeps_dir = os.path.join(out, 'sweeps')
+    os.makedirs(sweeps_dir, exist_ok=True)
+
+    # Only the requested gene sets are swept, and only from fits of the current
+    # data; other fits left in the output directory are ignored.
+    pending = []
+    for name in gene_sets:
+        target = os.path.join(fits_dir, f"{name}.json")
+        if not os.path.exists(target):
+            print(f"[sweep] skipping {name}, no fit found")
+            continue
+        fit = read_json(target)
+        if fit.get('data_version') != ingest.data_version():
+            print(f"[sweep] skipping {name}, its fit predates the current data; rerun the fit stage")
+            continue
+        done = os.path.join(sweeps_dir, f"{name}.done")
+        # A sweep is only current if it was run from the fit now on disk.
+        if os.path.exists(done) and not force and read_json(done).get('run_id') == fit.get('run_id'):
+            print(f"[sweep] checkpoint found, skipping: {name}")
+            continue
+        pending.append(fit)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(
+                sweep_worker, fit,
+                median_tpm.loc[fit['genes']], adjmat.loc[fit['genes'], fit['genes']],
+                args.days, args.sweep_factors
+            ): fit
+            for fit in pending
+        }
+        for future in as_completed(futures):
+            fit = futures[future]
+            name = fit['name']
+            for gene, values, trajectories in future.result():
+                results.write_sweep(
+                    name, fit['genes'],
+                    f"K[{gene}]", values, prediction_time(args.days), trajectories,
+                    path=os.path.join(out, 'results.h5')
+                )
+            write_json(os.path.join(sweeps_dir, f"{name}.done"), {'name': name, 'run_id': fit.get('run_id'), 'factors': args.sweep_factors})
+            print(f"[sweep] {name}: wrote carrying capacity sweeps")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the TUNA knock-down analysis pipeline without the web app.")
+    parser.add_argument('--output', '-o', default='results', help="Directory to write artefacts and checkpoints to.")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES, help="Stages to run (default: all).")
+    parser.add_argument('--tpm', help="TPM table (tab separated, genes by samples). Defaults to the project data, including ingested samples.")
+    parser.add_argument('--adjmat', default=os.path.join(APP_DIR, 'data/wgcna/figures/maroon_adjmat.csv'), help="Module adjacency matrix (csv).")
+    parser.add_argument('--hub-genes', default=os.path.join(APP_DIR, 'data/wgcna/figures/top_20_hub_genes_maroon.csv'), help="Hub gene table (csv).")
+    parser.add_argument('--gene-sets', help="JSON file mapping a gene set name to a list of genes to fit.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of fitting processes.")
+    parser.add_argument('--decay-rate', type=float, default=0.5)
+    parser.add_argument('--carrying-capacity', type=float, default=10.0)
+    parser.add_argument('--block-threshold', type=float, help="Fit weakly coupled blocks of each gene set separately, splitting on edges below this weight.")
+    parser.add_argument('--refine-iter', type=int, default=0, help=f"Optimiser iterations on the full model after a block fit (gene sets of at most {lib.REFINE_MAX_GENES} genes).")
+    parser.add_argument('--days', type=int, default=7, help="Number of days to integrate fitted models over.")
+    parser.add_argument('--sweep-factors', type=float, nargs='+', default=[0.5, 0.75, 1.0, 1.5, 2.0], help="Factors to scale each gene's carrying capacity by in the sweep stage.")
+    parser.add_argument('--force', action='store_true', help="Recompute stages even if their checkpoints exist.")
+    args = parser.parse_args()
+
+    # Paths given on the command line are relative to the caller, the data
+    # paths inside lib are relative to the app directory.
+    out = os.path.abspath(args.output)
+    gene_sets_path = os.path.abspath(args.gene_sets) if args.gene_sets else None
+    tpm_path = os.path.abspath(args.tpm) if args.tpm else None
+    adjmat_path, hyp_path = (os.path.abspath(path) for path in (args.adjmat, args.hub_genes))
+    os.chdir(APP_DIR)
+    os.makedirs(out, exist_ok=True)
+
+    if 'deg' in args.stages:
+        run_deg(out, args.force)
+
+    if set(args.stages) & {'median', 'fit', 'sweep'}:
+        tpm = pd.read_csv(tpm_path, sep='\t', index_col=0) if tpm_path else None
+        median_tpm = run_median(out, args.force, tpm)
+
+    if 'fit' in args.stages or 'sweep' in args.stages:
+        adjmat = pd.read_csv(adjmat_path, index_col=0)
+        gene_sets = load_gene_sets(gene_sets_path, pd.read_csv(hyp_path, index_col=0))
+
+    if 'fit' in args.stages:
+        stale = ingest.stale_artefacts()
+        refitted_all = run_fit(out, args.force, gene_sets, median_tpm, adjmat, args)
+        # Fits are only fresh again if all of them were recomputed from the
+        # project's own medians.
+        if 'fits' in stale and refitted_all and tpm_path is None:
+            ingest.mark_fresh('fits')
+        elif 'fits' in stale:
+            print("[fit] fits remain marked stale (not all gene sets were recomputed from the project data)")
+
+    if 'sweep' in args.stages:
+        run_sweep(out, args.force, gene_sets, median_tpm, adjmat, args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import numpy as np
+import plotly.graph_objects as go
+
+def decimate(x:np.ndarray, y:np.ndarray, max_points:int) -> tuple:
+    # Min-max decimation: keep the lowest and highest point of each bucket, so
+    # peaks survive downsampling.
+    if len(x) <= max_points:
+        return x, y
+    keep = {0, len(x) - 1}
+    for bucket in np.array_split(np.arange(len(x)), max(max_points // 2, 1)):
+        keep.update((bucket[np.argmin(y[bucket])], bucket[np.argmax(y[bucket])]))
+    keep = sorted(keep)
+    return x[keep], y[keep]
+
+def pack(x:np.ndarray, values:np.ndarray, genes:list, max_points:int=None) -> tuple:
+    # All genes go into one trace, each line separated from the next by a NaN
+    # so plotly does not join them.
+    xs, ys, labels = [], [], []
+    for i, gene in enumerate(genes):
+        gene_x, gene_y = decimate(x, values[:, i], max_points) if max_points else (x, values[:, i])
+        xs += [gene_x, [np.nan]]
+        ys += [gene_y, [np.nan]]
+        labels += [gene] * (len(gene_x) + 1)
+    return np.concatenate(xs), np.concatenate(ys), labels
+
+def per_gene_figure(fit:dict) -> go.Figure:
+    fig = go.Figure()
+
+    # Add traces for observed and modeled data
+    for i, gene in enumerate(fit['genes']):
+        fig.add_trace(go.Scatter(x=fit['observed_time_points'], y=fit['observed'][:, i], mode='lines+markers', name=f'Observed {gene}', line=dict(dash='dash')))
+        fig.add_trace(go.Scatter(x=fit['time_points'], y=fit['predictions'][:, i], mode='lines', name=f'Modelled {gene}'))
+        if fit['lower'] is not None:
+            fig.add_trace(go.Scatter(
+                x=np.concatenate([fit['time_points'], fit['time_points'][::-1]]),
+                y=np.concatenate([fit['upper'][:, i], fit['lower'][::-1, i]]),
+                fill='toself', opacity=0.2, line=dict(width=0), name=f'95% band {gene}'
+            ))
+    return fig
+
+def packed_figure(fit:dict, max_points:int=None) -> go.Figure:
+    hover = '%{text}<br>time=%{x}<br>TPM=%{y:.2f}<extra></extra>'
+    fig = go.Figure()
+
+    x, y, labels = pack(fit['observed_time_points'], fit['observed'], fit['genes'])
+    fig.add_trace(go.Scattergl(x=x, y=y, text=labels, mode='lines+markers', name='Observed', line=dict(dash='dash', width=1), opacity=0.6, hovertemplate=hover))
+
+    x, y, labels = pack(fit['time_points'], fit['predictions'], fit['genes'], max_points)
+    fig.add_trace(go.Scattergl(x=x, y=y, text=labels, mode='lines', name='Modelled', line=dict(width=1), opacity=0.6, hovertemplate=hover))
+    return fig
+
+def band(fig:go.Figure, x:np.ndarray, lower:np.ndarray, upper:np.ndarray, name:str, opacity:float) -> None:
+    fig.add_trace(go.Scatter(
+        x=np.concatenate([x, x[::-1]]),
+        y=np.concatenate([upper, lower[::-1]]),
+        fill='toself', opacity=opacity, line=dict(width=0), name=name
+    ))
+
+def summary_figure(fit:dict, gene:str=None) -> go.Figure:
+    # The module is summarised by quantiles across genes at each time point,
+    # so the number of traces does not depend on the number of genes.
+    fig = go.Figure()
+    time_points, predictions = fit['time_points'], fit['predictions']
+    q05, q25, q50, q75, q95 = np.percentile(predictions, [5, 25, 50, 75, 95], axis=1)
+
+    band(fig, time_points, q05, q95, 'Modelled 5-95%', 0.15)
+    band(fig, time_points, q25, q75, 'Modelled 25-75%', 0.3)
+    fig.add_trace(go.Scatter(x=time_points, y=q50, mode='lines', name='Modelled median'))
+    fig.add_trace(go.Scatter(
+        x=fit['observed_time_points'], y=np.median(fit['observed'], axis=1),
+        mode='lines+markers', name='Observed median', line=dict(dash='dash')
+    ))
+
+    if gene is not None:
+        i = fit['genes'].index(gene)
+        fig.add_trace(go.Scatter(x=fit['observed_time_points'], y=fit['observed'][:, i], mode='lines+markers', name=f'Observed {gene}', line=dict(dash='dash')))
+        fig.add_trace(go.Scatter(x=time_points, y=predictions[:, i], mode='lines', name=f'Modelled {gene}'))
+        if fit['lower'] is not None:
+            band(fig, time_points, fit['lower'][:, i], fit['upper'][:, i], f'95% band {gene}', 0.2)
+    return fig
@@ -0,0 +1,143 @@
+import fcntl
+import hashlib
+import os
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import h5py
+import numpy as np
+import pandas as pd
+
+# Results are kept in a single HDF5 file with one group per run:
+#   /fits/<run_id>    r, K, genes, time and the (time x gene) trajectory
+#   /sweeps/<run_id>  the swept values and a (value x time x gene) array
+# Run metadata (gene set, parameters, timestamp) is stored as group attributes.
+# Arrays are chunked along time and in small groups of genes, so reading one
+# gene or a time window only decompresses the chunks it touches.
+DEFAULT_PATH = 'data/results.h5'
+GENE_CHUNK = 16
+TIME_CHUNK = 1024
+
+def gene_set_key(genes:list) -> str:
+    # Names an unnamed gene set by its genes, whatever order they were picked in.
+    digest = hashlib.sha1('\n'.join(sorted(genes)).encode()).hexdigest()[:12]
+    return f"{len(genes)}_genes_{digest}"
+
+@contextmanager
+def locked(path:str, mode:int):
+    # HDF5 refuses to open a file another process has open for writing, so
+    # access goes through a lock file: readers share it, a writer holds it
+    # alone and keeps the file open only for the one run it adds.
+    with open(f"{path}.lock", 'a') as lock:
+        fcntl.flock(lock, mode)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+@contextmanager
+def writer(path:str):
+    with locked(path, fcntl.LOCK_EX), h5py.File(path, 'a', libver='latest') as f:
+        yield f
+
+@contextmanager
+def reader(path:str):
+    with locked(path, fcntl.LOCK_SH), h5py.File(path, 'r') as f:
+        yield f
+
+def new_group(f:h5py.File, kind:str, gene_set:str, attrs:dict) -> h5py.Group:
+    timestamp = datetime.now(timezone.utc)
+    run_id = f"{timestamp:%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+    group = f.require_group(kind).create_group(run_id)
+    group.attrs['gene_set'] = gene_set
+    group.attrs['timestamp'] = timestamp.isoformat()
+    for key, value in attrs.items():
+        group.attrs[key] = value
+    return group
+
+def create_array(group:h5py.Group, name:str, data:np.ndarray) -> None:
+    chunks = (1,) * (data.ndim - 2) + (min(data.shape[-2], TIME_CHUNK), min(data.shape[-1], GENE_CHUNK))
+    group.create_dataset(name, data=data, chunks=chunks, compression='gzip', compression_opts=4, shuffle=True)
+
+def write_fit(
+    gene_set:str,
+    genes:list,
+    params:np.ndarray,
+    time_points:np.ndarray,
+    trajectory:np.ndarray,
+    path:str=DEFAULT_PATH,
+    **attrs
+) -> str:
+    with writer(path) as f:
+        group = new_group(f, 'fits', gene_set, attrs)
+        group.create_dataset('genes', data=np.array(genes, dtype=object), dtype=h5py.string_dtype())
+        group.create_dataset('r', data=params[:len(genes)])
+        group.create_dataset('K', data=params[len(genes):])
+        group.create_dataset('time', data=time_points)
+        create_array(group, 'trajectory', np.asarray(trajectory, dtype=np.float32))
+        return group.name.split('/')[-1]
+
+def write_sweep(
+    gene_set:str,
+    genes:list,
+    parameter:str,
+    values:np.ndarray,
+    time_points:np.ndarray,
+    trajectories:np.ndarray,
+    path:str=DEFAULT_PATH,
+    **attrs
+) -> str:
+    with writer(path) as f:
+        group = new_group(f, 'sweeps', gene_set, dict(attrs, parameter=parameter))
+        group.create_dataset('genes', data=np.array(genes, dtype=object), dtype=h5py.string_dtype())
+        group.create_dataset('values', data=values)
+        group.create_dataset('time', data=time_points)
+        create_array(group, 'trajectories', np.asarray(trajectories, dtype=np.float32))
+        return group.name.split('/')[-1]
+
+def list_runs(kind:str='fits', gene_set:str=None, path:str=DEFAULT_PATH) -> pd.DataFrame:
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=['run_id', 'gene_set', 'timestamp'])
+    with reader(path) as f:
+        runs = [
+            dict(group.attrs, run_id=run_id, n_genes=len(group['genes']))
+            for run_id, group in f.get(kind, {}).items()
+        ]
+    if not runs:
+        return pd.DataFrame(columns=['run_id', 'gene_set', 'timestamp'])
+    runs = pd.DataFrame(runs)
+    if gene_set is not None:
+        runs = runs[runs['gene_set'] == gene_set]
+    return runs.sort_values('timestamp', ascending=False).reset_index(drop=True)
+
+def selection(group:h5py.Group, genes:list, t_start:float, t_end:float) -> tuple:
+    time_points = group['time'][:]
+    start = 0 if t_start is None else int(np.searchsorted(time_points, t_start, side='left'))
+    end = len(time_points) if t_end is None else int(np.searchsorted(time_points, t_end, side='right'))
+
+    all_genes = group['genes'].asstr()[:].tolist()
+    if genes is None:
+        return time_points[start:end], slice(start, end), slice(None), slice(None), all_genes
+    # HDF5 point selections must be in increasing order, so the columns are
+    # read sorted and `order` puts them back in the order they were asked for.
+    indices = [all_genes.index(gene) for gene in genes]
+    columns = sorted(set(indices))
+    order = np.searchsorted(columns, indices)
+    return time_points[start:end], slice(start, end), columns, order, list(genes)
+
+def read_fit(run_id:str, path:str=DEFAULT_PATH) -> pd.DataFrame:
+    with reader(path) as f:
+        group = f['fits'][run_id]
+        return pd.DataFrame({'r': group['r'][:], 'K': group['K'][:]}, index=group['genes'].asstr()[:])
+
+def read_trajectory(run_id:str, genes:list=None, t_start:float=None, t_end:float=None, path:str=DEFAULT_PATH) -> pd.DataFrame:
+    with reader(path) as f:
+        group = f['fits'][run_id]
+        time_points, rows, columns, order, names = selection(group, genes, t_start, t_end)
+        return pd.DataFrame(group['trajectory'][rows, columns][:, order], index=time_points, columns=names)
+
+def read_sweep(run_id:str, genes:list=None, t_start:float=None, t_end:float=None, path:str=DEFAULT_PATH) -> tuple:
+    with reader(path) as f:
+        group = f['sweeps'][run_id]
+        time_points, rows, columns, order, names = selection(group, genes, t_start, t_end)
+        return group['values'][:], time_points, names, group['trajectories'][:, rows, columns][..., order]
@@ -41,6 +41,26 @@ def stats_page():
     st.subheader("Differentially Expressed Genes (DEGs)")
     st.data_editor(deg, use_container_width=True)
 
+    st.write(
+        """
+        Search for a gene by symbol or Ensembl ID (prefixes and substrings both match) to see its results across \
+        the contrasts:
+        """
+    )
+
+    gene_index = lib.load_gene_index()
+    query = st.text_input("Gene search", placeholder="e.g. Wls or ENSMUSG00000028173")
+    matches = gene_index.search(query)
+    if query and not matches:
+        st.warning(f"No genes match '{query}'.")
+    elif matches:
+        gene = st.selectbox("Matching genes", matches, format_func=gene_index.label)
+        gene_ids = gene_index.ids(gene)
+        st.dataframe(
+            deg[deg["Gene_ID"].isin(gene_ids)].assign(Gene_name=gene_index.symbol(gene)),
+            use_container_width=True
+        )
+
     st.write(
         """
         ***
@@ -1,5 +1,5 @@
 import streamlit as st
-from streamlit_pdf_viewer import pdf_viewer
+import assets
 
 def wgcna_page():
     st.title("Weighted Gene Co-expression Network Analysis (WGCNA)")
@@ -51,7 +51,7 @@ def wgcna_page():
 
     st.subheader("Sample heirarchical clustering for outlier detection")
     st.write("The preprocessing step in WGCNA includes the removal of outliers. The following figure shows the sample clustering:")
-    pdf_viewer("data/wgcna/figures/sample_clustering_cleaning.pdf", width = 1000)
+    assets.figure("data/wgcna/figures/sample_clustering_cleaning.pdf", width=1000)
     st.write(
         """
         The samples in the dendrogram, from left to right, are:
@@ -71,7 +71,7 @@ def wgcna_page():
 
     st.subheader("Scale-free network power estimation")
     st.write("The first step for finding modules is to estimate the power of the network. The following figure shows the power estimation:")
-    pdf_viewer("data/wgcna/figures/summary_power.pdf", width = 800)
+    assets.figure("data/wgcna/figures/summary_power.pdf", width=800)
     st.write(
         """
         As evident, a soft-thresholding power of 10 returns the highest correlation between the gene-gene interactions in the graph \
@@ -83,7 +83,7 @@ def wgcna_page():
 
     st.subheader("Module relationships")
     st.write("The following figure shows the module relationships after constructing the graph and identifying communities (modules):")
-    pdf_viewer("data/wgcna/figures/eigenesgenes.pdf", width = 1000)
+    assets.figure("data/wgcna/figures/eigenesgenes.pdf", width=1000)
     st.write(
         """
         The dendrogram shows the modules of co-expressed genes, and how overlapping, or closely related, they are. \
@@ -139,7 +139,7 @@ def wgcna_page():
 
     st.subheader("Module-trait relationships")
     st.write("The following figure shows the module-trait relationships:")
-    pdf_viewer("data/wgcna/figures/module-traitRelationships.pdf", width = 2000)
+    assets.figure("data/wgcna/figures/module-traitRelationships.pdf", width=1000, fmt="jpg")
     st.write(
         """
         The heatmap shows the correlation between the module eigengenes and the traits of interest. The correlation is \
@@ -155,7 +155,7 @@ def wgcna_page():
 
     st.subheader("Modules with significant correlation with Day + Treatment")
     st.write("##### Maroon (upregulated)")
-    pdf_viewer("data/wgcna/figures/module_heatmap_eigengene_maroon.pdf", width = 700)
+    assets.figure("data/wgcna/figures/module_heatmap_eigengene_maroon.pdf", width=700, fmt="jpg")
     st.write(
         """
         The maroon module shows a high, positive correlation with treatment across time. The module eigengene expression \
@@ -171,7 +171,7 @@ def wgcna_page():
     )
 
     st.write("##### Floralwhite (upregulated)")
-    pdf_viewer("data/wgcna/figures/module_heatmap_eigengene_floralwhite.pdf", width = 700)
+    assets.figure("data/wgcna/figures/module_heatmap_eigengene_floralwhite.pdf", width=700, fmt="jpg")
     st.write(
         """
         The floralwhite module also shows a high, positive correlation with treatment across time (slight exception with \
@@ -184,7 +184,7 @@ def wgcna_page():
     )
 
     st.write("##### Gainsboro (downregulated)")
-    pdf_viewer("data/wgcna/figures/module_heatmap_eigengene_gainsboro.pdf", width = 700)
+    assets.figure("data/wgcna/figures/module_heatmap_eigengene_gainsboro.pdf", width=700, fmt="jpg")
     st.write(
         """
         The gainsboro module shows a high, negative correlation with treatment across time. The module eigengene expression \